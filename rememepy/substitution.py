@@ -1,3 +1,7 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from PIL import Image
 from .supporting_functions import *
 
@@ -7,6 +11,12 @@ class Generator:
         self.last_placement_position = None
         self.last_resized_substitute = None
         self.last_template = None
+        self._last_template_size = None
+        self._last_substitute_size = None
+        self._template_arr_cache = None
+        self._dominant_color_cache = {}  # dominant cluster amount -> dominant color of the cached template
+        self._placement_cache = {}  # rounded dominant color -> placement in the cached template
+        self._mask_buffer = None  # reused by every placement scan of a template with the same size
 
     def substitute(self, source_img_path: str, substitute_img_path: str,
                    dominant_cluster_amount: int = 6,
@@ -23,7 +33,7 @@ class Generator:
             source_img_path (str): Path to the original image to modify.
             substitute_img_path (str): Path to the image to paste into the source.
             dominant_cluster_amount (int, optional): Number of clusters to use when identifying
-                the dominant color. If 0, white is used as the dominant color. Defaults to 3.
+                the dominant color. If 0, white is used as the dominant color. Defaults to 6.
             resize_to (tuple, optional): If provided, explicitly resizes the substitute image to this
                 size (width, height) before pasting. If None, it resizes based on the detected area.
 
@@ -31,24 +41,65 @@ class Generator:
             PIL.Image.Image: The modified source image with the substitute image pasted in.
         """
 
-        template = Image.open(source_img_path)
-        substitute = Image.open(substitute_img_path)
+        substitute = Image.open(substitute_img_path).convert("RGB")
+        template_arr = self._template_array(source_img_path)
+
+        return self._substitute_from_objects(substitute, template_arr, dominant_cluster_amount, resize_to)
+
+    def _template_array(self, source_img_path: str) -> np.ndarray:
+        """Returns the RGB pixel array of the template, the file is only opened again once it is modified."""
+
+        # file objects have no modification time to key the cache with, they are always read again
+        if isinstance(source_img_path, (str, os.PathLike)):
+            key = (source_img_path, os.path.getmtime(source_img_path))
+        else:
+            key = None
+
+        if key is None or self._template_arr_cache is None or self._template_arr_cache[0] != key:
+            template = Image.open(source_img_path).convert("RGB")
+            self._template_arr_cache = (key, np.ascontiguousarray(np.asarray(template)))
+            self._dominant_color_cache.clear()
+            self._placement_cache.clear()
+
+        return self._template_arr_cache[1]
+
+    def _substitute_from_objects(self, substitute: Image.Image, template_arr: np.ndarray,
+                                 dominant_cluster_amount: int = 6,
+                                 resize_to: tuple | None = None) -> Image.Image:
+        """Same as `substitute`, but works on the opened RGB substitute and the (untouched) template array."""
 
         if resize_to:
             resized_substitute = substitute.resize(resize_to)
             placement_position = (0, 0)  # if manual resize, default placement
         else:
-            dominant_color = (255, 255, 255) if dominant_cluster_amount == 0 else find_dominant_color(template,
-                                                                                                dominant_cluster_amount)
-            placement_position, new_size = find_placement(template, dominant_color)
+            if dominant_cluster_amount == 0:
+                dominant_color = (255, 255, 255)
+            elif dominant_cluster_amount in self._dominant_color_cache:
+                dominant_color = self._dominant_color_cache[dominant_cluster_amount]
+            else:
+                dominant_color = find_dominant_color(template_arr, dominant_cluster_amount)
+                self._dominant_color_cache[dominant_cluster_amount] = dominant_color
+
+            # near identical dominant colors share one placement scan
+            color_key = tuple(int(round(c)) & 0xF8 for c in dominant_color)
+            if color_key not in self._placement_cache:
+                if self._mask_buffer is None or self._mask_buffer.shape != template_arr.shape[:2]:
+                    self._mask_buffer = np.empty(template_arr.shape[:2], dtype=bool)
+                self._placement_cache[color_key] = find_placement(template_arr, dominant_color, self._mask_buffer)
+            placement_position, new_size = self._placement_cache[color_key]
             resized_substitute = substitute.resize(new_size)
 
-        template.paste(resized_substitute, placement_position)
+        # copy the pristine pixels and paste into them directly, the cached template array stays clean
+        result_arr = template_arr.copy()
+        paste_array(result_arr, np.asarray(resized_substitute), placement_position)
+        template = Image.fromarray(result_arr)
 
         # save state for validation
         self.last_placement_position = placement_position
         self.last_resized_substitute = resized_substitute
         self.last_template = template
+        self._last_template_size = template.size
+        self._last_substitute_size = resized_substitute.size
 
         return template
 
@@ -74,19 +125,18 @@ class Generator:
             - Ensure the internal state (e.g., placement position and size) is tracked for validation to work.
         """
 
-        if not all([self.last_template, self.last_resized_substitute, self.last_placement_position]):
+        if None in (self._last_template_size, self._last_substitute_size, self.last_placement_position):
             raise ValueError("No substitution has been performed yet.")
 
-        template_area = self.last_template.size[0] * self.last_template.size[1]
-        substitute_area = self.last_resized_substitute.size[0] * self.last_resized_substitute.size[1]
-        coverage_ratio = substitute_area / template_area
+        template_width, template_height = self._last_template_size
+        w, h = self._last_substitute_size
+        coverage_ratio = (w * h) / (template_width * template_height)
 
         if not (threshold_min <= coverage_ratio <= threshold_max):
             return False
 
         x, y = self.last_placement_position
-        w, h = self.last_resized_substitute.size
-        if x < 0 or y < 0 or x + w > self.last_template.size[0] or y + h > self.last_template.size[1]:
+        if x < 0 or y < 0 or x + w > template_width or y + h > template_height:
             return False
 
         return True
@@ -107,7 +157,7 @@ class Generator:
             source_img_path (str): Path to the source image to modify.
             substitute_img_path (str): Path to the image to paste into the source.
             cluster_range (tuple, optional): A range of integers (inclusive) to use for dominant color clustering.
-                Defaults to (0, 6). If 0 is used, white is used as the dominant color.
+                Defaults to (0, 10). If 0 is used, white is used as the dominant color.
 
         Returns:
             PIL.Image.Image | None: The first successfully validated substituted image, or None if no valid
@@ -117,14 +167,39 @@ class Generator:
             - `cluster_range` should define a reasonable span to avoid unnecessary processing time.
         """
 
-        for cluster_amount in range(cluster_range[0], cluster_range[1] + 1):
-            result_img = self.substitute(
-                source_img_path,
-                substitute_img_path,
-                dominant_cluster_amount=cluster_amount
-            )
-
-            if self.validate_last_substitution():
-                return result_img
+        # open, decode and convert both images only once for all attempts
+        substitute_src = Image.open(substitute_img_path).convert("RGB")
+        template_arr = self._template_array(source_img_path)
+
+        # after a failed attempt, the next few amounts are clustered in parallel while the attempts go on in order
+        cluster_amounts = list(range(cluster_range[0], cluster_range[1] + 1))
+        look_ahead = min(os.cpu_count() or 1, 2)
+        executor = ThreadPoolExecutor(max_workers=look_ahead)
+        pending_colors = {}
+
+        try:
+            for index, cluster_amount in enumerate(cluster_amounts):
+                if cluster_amount in pending_colors:
+                    self._dominant_color_cache[cluster_amount] = pending_colors.pop(cluster_amount).result()
+
+                result_img = self._substitute_from_objects(
+                    substitute_src,
+                    template_arr,
+                    dominant_cluster_amount=cluster_amount
+                )
+
+                if self.validate_last_substitution():
+                    return result_img
+
+                for upcoming_amount in cluster_amounts[index + 1:index + 1 + look_ahead]:
+                    if upcoming_amount == 0 or upcoming_amount in self._dominant_color_cache:
+                        continue  # white or already known, nothing to cluster
+                    if upcoming_amount not in pending_colors:
+                        pending_colors[upcoming_amount] = executor.submit(
+                            find_dominant_color, template_arr, upcoming_amount
+                        )
+        finally:
+            # amounts that have not started are dropped, at most the look-ahead window is waited for
+            executor.shutdown(wait=True, cancel_futures=True)
 
         return None
@@ -1,23 +1,34 @@
-from PIL import Image
+from PIL import Image, features
 import numpy as np
 import scipy
 import scipy.cluster
 
 
-def find_dominant_color(img: Image, dominant_clusters_amount: int, resize: tuple | None = None) -> tuple:
+def find_dominant_color(ar: np.ndarray, dominant_clusters_amount: int, resize: tuple | None = (128, 128)) -> tuple:
     """Finds the color that covers most of the image."""
 
-    # the option to resize the image
-    img = img.resize(resize) if resize is not None else img
+    # large images are shrunk to fit the resize box by default, the dominant color does not need every pixel
+    if resize is not None and (ar.shape[1] > resize[0] or ar.shape[0] > resize[1]):
+        img = Image.fromarray(ar)
+        img.thumbnail(resize, Image.Resampling.BILINEAR)
+        ar = np.asarray(img)
+
+    # libimagequant builds the palette in C, much faster than k-means, when Pillow is built with it
+    if features.check("libimagequant"):
+        quantized = Image.fromarray(ar).quantize(colors=dominant_clusters_amount,
+                                                 method=Image.Quantize.LIBIMAGEQUANT)
+        palette = np.asarray(quantized.getpalette(), dtype=np.uint8).reshape(-1, 3)[:dominant_clusters_amount]
+        counts = np.bincount(np.asarray(quantized).ravel(), minlength=len(palette))  # count occurrences
+
+        return tuple(palette[counts.argmax()].tolist())
 
-    ar = np.asarray(img)
     shape = ar.shape
-    ar = ar.reshape(np.prod(shape[:2]), shape[2]).astype(float)
+    ar = ar.reshape(np.prod(shape[:2]), shape[2]).astype(np.float32, copy=False)
 
     codes, dist = scipy.cluster.vq.kmeans(ar, dominant_clusters_amount)
 
     vecs, dist = scipy.cluster.vq.vq(ar, codes)  # assign codes
-    counts, bins = np.histogram(vecs, len(codes))  # count occurrences
+    counts = np.bincount(vecs, minlength=len(codes))  # count occurrences
 
     index_max = np.argmax(counts)  # find most frequent
     peak = codes[index_max]
@@ -25,74 +36,73 @@ def find_dominant_color(img: Image, dominant_clusters_amount: int, resize: tuple
     return tuple(peak)
 
 
-def are_colors_similar(color1: tuple, color2: tuple, tolerance: int) -> bool:
-    """Compares if two colors are similar enough."""
+def colors_similar_batch(ar: np.ndarray, dominant_color: tuple, tolerance: int,
+                         out: np.ndarray | None = None) -> np.ndarray:
+    """Marks every pixel of the image array that is within the tolerance of the dominant color in every channel."""
+
+    mask = np.ones(ar.shape[:2], dtype=bool) if out is None else out
+    mask.fill(True)
+
+    # compared against the unrounded dominant color, k-means centroids are floats
+    for channel in range(3):
+        channel_values = ar[..., channel]
+        mask &= channel_values > float(dominant_color[channel]) - tolerance
+        mask &= channel_values < float(dominant_color[channel]) + tolerance
 
-    color1_sum = color1[0] + color1[1] + color1[2]
-    color2_sum = color2[0] + color2[1] + color2[2]
-    difference = abs(color2_sum - color1_sum)
-    if difference < tolerance:
-        return True
-    else:
-        return False
+    return mask
 
 
-def find_placement(template: Image, dominant_color: tuple) -> tuple:
+def find_placement(ar: np.ndarray, dominant_color: tuple, mask_buffer: np.ndarray | None = None) -> tuple:
     """Finds the ideal area for a substitute image to be pasted to."""
 
-    template_width, template_height = template.size
-    template_pixel_grid = template.load()
-
-    substitute_width, substitute_height = 0, 0
-    starting_position = None
-    current_matching_lines_streak = 0
-
-    # runs through every line of pixels in the image to find which lines are mostly not made up of the dominant color
-    for y in range(template_height):
-        tolerance = template_width // 2  # set tolerance for how many dominant color pixels are allowed per line
-        line_start = None
-        last_different = None
-        passed = True
-
-        # running through one line
-        for x in range(template_width):
-            try:
-                color = template_pixel_grid[x, y]  # get the color of the current pixel
-            except IndexError:
-                raise f"Error with extracting pixel colors pos {x}/{y}"
-            else:
-                # check if the color is similar to the dominant color
-                if are_colors_similar(color, dominant_color, 30):
-                    tolerance -= 1  # decrease tolerance if pixel matches dominant color
-                    if tolerance == 0:
-                        passed = False  # too many dominant color pixels, line fails
-                        break
-
-                    # update substitute width if a longer segment is found
-                    if line_start is not None and last_different is not None:
-                        current_line_length = last_different[0] - line_start[0]
-                        if current_line_length > substitute_width:
-                            substitute_width = current_line_length
-
-                else:
-                    last_different = x, y  # update last different color pixel
-                    if line_start is None:
-                        line_start = x, y  # mark start of different color segment
-
-            # update substitute width if a longer segment is found
-            if line_start is not None and last_different is not None:
-                current_line_length = last_different[0] - line_start[0]
-                if current_line_length > substitute_width:
-                    substitute_width = current_line_length
-
-        # if the line passed, increment streak of matching lines
-        if passed and y != template_height - 1:
-            current_matching_lines_streak += 1
-        else:
-            # update substitute height and starting position if a larger area is found
-            if substitute_height < current_matching_lines_streak and line_start is not None:
-                substitute_height = current_matching_lines_streak
-                starting_position = line_start[0], line_start[1] - substitute_height
-            current_matching_lines_streak = 0
+    # the shape is checked once up front instead of guarding every pixel access
+    if ar.ndim != 3 or ar.shape[2] < 3:
+        raise ValueError(f"Expected an RGB pixel array, got shape {ar.shape}")
+
+    template_height, template_width = ar.shape[:2]
+
+    mask = colors_similar_batch(ar, dominant_color, 15, out=mask_buffer)  # pixels similar to the dominant color
+
+    # a line fails once it reaches the tolerance of dominant color pixels, scanning stops at that pixel
+    tolerance = template_width // 2
+    passed = np.count_nonzero(mask, axis=1) < tolerance
+
+    # pixels of the scanned part of every line that are not the dominant color, passed lines are scanned whole
+    different = ~mask
+    failed = np.flatnonzero(~passed)
+    different[failed] &= np.cumsum(mask[failed], axis=1, dtype=np.int32) < tolerance
+
+    # first and last different pixel of every line, the widest span is the substitute width
+    has_different = different.any(axis=1)
+    line_starts = different.argmax(axis=1)
+    line_ends = template_width - 1 - different[:, ::-1].argmax(axis=1)
+    spans = np.where(has_different, line_ends - line_starts, 0)
+    substitute_width = int(spans.max())
+
+    # a streak of passed lines ends with a failed line or with the last line of the image
+    breaking_lines = np.flatnonzero(~passed[:-1])
+    breaking_lines = np.append(breaking_lines, template_height - 1)
+    streaks = np.diff(breaking_lines, prepend=-1) - 1
+    streaks = np.where(has_different[breaking_lines], streaks, 0)
+
+    substitute_height, starting_position = 0, None
+    if streaks.max() > 0:
+        longest = streaks.argmax()  # first of the longest streaks
+        substitute_height = int(streaks[longest])
+        y = breaking_lines[longest]
+        starting_position = int(line_starts[y]), int(y - substitute_height)
 
     return starting_position, (substitute_width, substitute_height)
+
+
+def paste_array(ar: np.ndarray, substitute_ar: np.ndarray, position: tuple | None) -> None:
+    """Pastes the substitute into the template array in place, the part outside of the template is cut off."""
+
+    x, y = position if position is not None else (0, 0)
+    template_height, template_width = ar.shape[:2]
+    substitute_height, substitute_width = substitute_ar.shape[:2]
+
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + substitute_width, template_width), min(y + substitute_height, template_height)
+    if left < right and top < bottom:
+        ar[top:bottom, left:right] = substitute_ar[top - y:bottom - y, left - x:right - x]